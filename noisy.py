@@ -1,9 +1,10 @@
 import asyncio
 import datetime
+import functools
 import logging
 import random
 import re
-from urllib.parse import urljoin, urlparse
+from urllib.parse import urljoin, urlsplit
 
 import aiohttp
 
@@ -14,33 +15,20 @@ class CrawlerTimedOut(Exception):
     pass
 
 
-logging.basicConfig(
-    format=settings.LOG_FMT,
-    datefmt=settings.DATE_FMT,
-    style='{',
-    level=settings.LOG_LEVEL
-)
+VALID_SCHEMES = ('http', 'https', 'ftp', 'ftps')
+# the most common hrefs that could never be requested
+SKIPPED_SCHEMES = ('javascript:', 'mailto:', 'tel:', 'data:')
 
+# ignore empty links and ones starting with #, no point in re-visiting the same page.
+# Negated classes instead of a lazy '.*?' let the value be scanned in one pass
+HREF_RE = re.compile(r"href=[\"']([^\"'#\n][^\"'\n]*)[\"']")
+WHITESPACE_RE = re.compile(r'\s')
 
-async def request(url: str) -> str:
-    random_user_agent = random.choice(settings.USER_AGENTS)
-    headers = {'user-agent': random_user_agent}
-    timeout = aiohttp.ClientTimeout(settings.REQUEST_TIMEOUT)
-
-    async with aiohttp.ClientSession(timeout=timeout) as ses:
-        logging.debug('%s: requesting', url)
-        try:
-            resp = await ses.get(url, headers=headers)
-            resp.raise_for_status()
-        except Exception:
-            logging.error("%s: requesting error", url)
-            return ''
-        else:
-            logging.debug("%s: response received", url)
-
-    return await resp.text()
+# links of a page, index of the one to visit and its depth
+Task = tuple[list[str], int, int]
 
 
+@functools.lru_cache(maxsize=8192)
 def normalize_link(link: str, root_url: str) -> str:
     """
     Normalizes links extracted from the DOM by making them all absolute, so
@@ -50,23 +38,19 @@ def normalize_link(link: str, root_url: str) -> str:
     :param root_url: the URL the DOM was loaded from
     :return: absolute link
     """
+    # most of the links are already absolute, no need to parse them
+    if link.startswith(('http://', 'https://')):
+        return link
+
+    # '//' means keep the current protocol used to access this URL,
+    # otherwise possibly a relative path. Links with another
+    # scheme, like "mailto:", are returned by urljoin as is
     try:
-        parsed_url = urlparse(link)
+        return urljoin(root_url, link)
     except ValueError:
         # urlparse can get confused about urls with the ']'
         # character and thinks it must be a malformed IPv6 URL
         return ''
-    parsed_root_url = urlparse(root_url)
-
-    # '//' means keep the current protocol used to access this URL
-    if link.startswith("//"):
-        return f"{parsed_root_url.scheme}://{parsed_url.netloc}{parsed_url.path}"
-
-    # possibly a relative path
-    if not parsed_url.scheme:
-        return urljoin(root_url, link)
-
-    return link
 
 
 def is_valid_url(url: str) -> bool:
@@ -74,43 +58,100 @@ def is_valid_url(url: str) -> bool:
     Check if a url is a valid url.
     Used to filter out invalid values that were found in the "href" attribute,
     for example "javascript:void(0)"
-    taken from https://stackoverflow.com/questions/7160737
     :param url: url to be checked
     :return: boolean indicating whether the URL is valid or not
     """
-    regex = re.compile(
-        r'^(?:http|ftp)s?://'  # http:// or https://
-        r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # domain...
-        r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # ...or ip
-        r'(?::\d+)?'  # optional port
-        r'(?:/?|[/?]\S+)$', re.IGNORECASE)
-    return re.match(regex, url) is not None
+    if WHITESPACE_RE.search(url) is not None:
+        return False
+
+    try:
+        parsed_url = urlsplit(url)
+        hostname = parsed_url.hostname
+    except ValueError:
+        # urlsplit can get confused about urls with the ']'
+        # character and thinks it must be a malformed IPv6 URL
+        return False
+
+    # urlsplit lowercases both the scheme and the hostname
+    if parsed_url.scheme not in VALID_SCHEMES or hostname is None:
+        return False
+
+    # a domain or an ip, no point in requesting something like "localhost",
+    # a trailing dot is allowed, but no empty labels like in "example..com"
+    labels = hostname.removesuffix('.').split('.')
+    return len(labels) > 1 and all(labels)
 
 
 class Crawler:
     def __init__(self):
+        self._cfg = settings.get_settings()
         self._start_time = None
-        self._links = []
-        self._blacklist = settings.BLACKLISTED_URLS.copy()
+        # configured urls are matched as substrings by one pattern compiled once,
+        # '(?!)' never matches, an empty pattern would match any url
+        self._blacklist_re = re.compile(
+            '|'.join(map(re.escape, set(self._cfg.blacklisted_urls))) or '(?!)'
+        )
+        # dead-end links are matched exactly, so they don't need a recompilation
+        self._dead_ends: set[str] = set()
+        # aiohttp copies the headers into every request, so they could be shared
+        self._ua_headers = tuple(
+            {'user-agent': user_agent}
+            for user_agent in self._cfg.user_agents
+        )
 
-    def _is_blacklisted(self, url: str) -> bool:
-        """
-        Checks is a URL is blacklisted
-        :param url: full URL
-        :return: boolean indicating whether a URL is blacklisted or not
-        """
-        return any(
-            blacklisted_url in url
-            for blacklisted_url in self._blacklist
+        # one session for the whole run, so connections are kept alive and reused.
+        # Resolved hosts are cached, aiohttp resolves them in the threadpool
+        # unless aiodns is installed, it doesn't pick AsyncResolver on its own
+        # aiohttp imports aiodns itself and leaves None when it isn't installed
+        resolver = aiohttp.AsyncResolver() if aiohttp.resolver.aiodns is not None else None
+        self._connector = aiohttp.TCPConnector(
+            resolver=resolver,
+            limit=self._cfg.connections_limit,
+            limit_per_host=self._cfg.connections_per_host_limit,
+            ttl_dns_cache=self._cfg.dns_cache_ttl,
+            use_dns_cache=True
         )
+        self._session = aiohttp.ClientSession(
+            connector=self._connector,
+            timeout=aiohttp.ClientTimeout(self._cfg.request_timeout)
+        )
+
+    async def _request(self, url: str) -> str:
+        headers = random.choice(self._ua_headers)
 
-    def _should_accept_url(self, url: str) -> bool:
+        logging.debug('%s: requesting', url)
+        try:
+            async with self._session.get(url, headers=headers) as resp:
+                resp.raise_for_status()
+                # no point in downloading and decoding huge pages only to find links
+                if (resp.content_length or 0) > self._cfg.max_body_size:
+                    logging.debug("%s: response is too large", url)
+                    return ''
+
+                # the length might be unknown, so the body is truncated anyway
+                data = bytearray()
+                while size := self._cfg.max_body_size - len(data):
+                    if not (chunk := await resp.content.read(size)):
+                        break
+                    data += chunk
+
+                try:
+                    body = data.decode(resp.charset or 'utf-8', errors='replace')
+                except LookupError:
+                    # unknown charset label, like "utf8mb4"
+                    body = data.decode('utf-8', errors='replace')
+        except Exception:
+            logging.error("%s: requesting error", url)
+            return ''
+
+        logging.debug("%s: response received", url)
+        return body
+
+    async def close(self) -> None:
         """
-        filters url if it is blacklisted or not valid, we put filtering logic here
-        :param url: full url to be checked
-        :return: boolean of whether or not the url should be accepted and potentially visited
+        Closes the session and its connection pool
         """
-        return bool(url) and is_valid_url(url) and not self._is_blacklisted(url)
+        await self._session.close()
 
     def _extract_urls(self, body: str, root_url: str) -> list[str]:
         """
@@ -120,67 +161,98 @@ class Crawler:
         :param root_url: the root URL of the given body
         :return: list of extracted links
         """
-        pattern = r"href=[\"'](?!#)(.*?)[\"'].*?"  # ignore links starting with #, no point in re-visiting the same page
-        urls = re.findall(pattern, str(body))
+        # pages repeat the same links in menus and footers, drop
+        # the duplicates before doing any per link work in Python
+        urls = dict.fromkeys(HREF_RE.findall(body))
 
-        normalized_urls = [
+        # normalized urls are filtered lazily, only the accepted ones are stored
+        normalized_urls = (
             normalize_link(url, root_url)
             for url in urls
-        ]
+            if not url.startswith(SKIPPED_SCHEMES)
+        )
+        # look up the blacklist attributes once per page
+        blacklist_search, dead_ends = self._blacklist_re.search, self._dead_ends
 
+        # accept only valid and not blacklisted urls
         return [
             url for url in normalized_urls
-            if self._should_accept_url(url)
+            if url not in dead_ends and is_valid_url(url) and blacklist_search(url) is None
         ]
 
-    def _remove_and_blacklist(self, link: str) -> None:
+    def _remove_and_blacklist(self, links: list[str], index: int) -> None:
         """
-        Removes a link from our current links list
+        Removes a link from the given links list
         and blacklists it so we don't visit it in the future
-        :param link: link to remove and blacklist
+        :param links: links list to remove the link from
+        :param index: index of the link to remove and blacklist
         """
-        self._blacklist += [link]
-        self._links.pop(self._links.index(link))
+        # order of the links doesn't matter, so swap
+        # the link with the last one to pop it in O(1)
+        links[index], links[-1] = links[-1], links[index]
+        self._dead_ends.add(links.pop())
 
-    async def _browse_from_links(self, depth: int = 0) -> None:
+    def _root_task(self) -> Task:
         """
-        Selects a random link out of the available link list and visits it.
-        Blacklists any link that is not responsive or that contains no other links.
-        Please note that this function is recursive and will keep calling itself until
-        a dead end has reached or when we ran out of links
-        :param depth: our current link depth
+        Selects a random root url to start browsing from
+        :return: task to visit the root url
         """
-        if not self._links or depth >= settings.MAX_DEPTH:
-            logging.debug("Hit a dead end, moving to the next root URL")
-            # escape from the recursion, we don't have links to continue or we have reached the max depth
-            return
+        return [random.choice(self._cfg.root_urls)], 0, 0
 
-        if self._is_timeout_reached():
-            raise CrawlerTimedOut
+    async def _browse_from_links(self, links: list[str], index: int, depth: int) -> Task:
+        """
+        Visits a link and selects a random link out of the found ones to be visited next.
+        Blacklists any link that is not responsive or that contains no other links
+        and retries with another link of the page the link was found on.
+        Moves to a random root url when a dead end has reached,
+        when we ran out of links or when we have reached the max depth
+        :param links: links of the page the link was found on
+        :param index: index of the link to visit
+        :param depth: our current link depth, 0 for a root url
+        :return: next task to visit
+        """
+        link = links[index]
+        sub_page = await self._request(link)
+        sub_links = self._extract_urls(sub_page, link)
+        logging.debug("%s: found %s links", link, len(sub_links))
 
-        random_link = random.choice(self._links)
-        try:
-            sub_page = await request(random_link)
-            sub_links = self._extract_urls(sub_page, random_link)
+        sleep = random.randrange(self._cfg.min_sleep, self._cfg.max_sleep)
+        await asyncio.sleep(sleep)
+
+        # make sure we have more than 1 link to pick from
+        if len(sub_links) > 1 or depth == 0:
+            links = sub_links
+        else:
+            # else retry with current link list
+            # remove the dead-end link from our list
+            self._remove_and_blacklist(links, index)
+
+        depth += 1
+        if not links or depth > self._cfg.max_depth:
+            logging.debug("Hit a dead end, moving to the next root URL")
+            return self._root_task()
 
-            sleep = random.randrange(settings.MIN_SLEEP, settings.MAX_SLEEP)
-            await asyncio.sleep(sleep)
+        return links, random.randrange(len(links)), depth
 
-            # make sure we have more than 1 link to pick from
-            if len(sub_links) > 1:
-                # extract links from the new page
-                self._links = self._extract_urls(sub_page, random_link)
-            else:
-                # else retry with current link list
-                # remove the dead-end link from our list
-                self._remove_and_blacklist(random_link)
+    async def _worker(self, queue: asyncio.Queue[Task]) -> None:
+        """
+        Takes tasks from the queue, visits them and puts
+        the next ones back until the timeout is reached
+        :param queue: queue of tasks to visit
+        """
+        while True:
+            if self._is_timeout_reached():
+                raise CrawlerTimedOut
 
-        except aiohttp.ClientError as e:
-            logging.debug("%s: an exception occurred (%s), removing from list and trying again!",
-                          random_link, repr(e))
-            self._remove_and_blacklist(random_link)
+            links, index, depth = await queue.get()
+            link = links[index]
+            try:
+                task = await self._browse_from_links(links, index, depth)
+            except Exception as e:
+                logging.warning("%s: error occurred: %s", link, repr(e))
+                task = self._root_task()
 
-        await self._browse_from_links(depth + 1)
+            queue.put_nowait(task)
 
     def _is_timeout_reached(self) -> bool:
         """
@@ -189,7 +261,7 @@ class Crawler:
         :return: boolean indicating whether the timeout has reached
         """
         is_timed_out = False
-        if timeout := settings.TIMEOUT:
+        if timeout := self._cfg.timeout:
             end_time = self._start_time + datetime.timedelta(seconds=timeout)
             is_timed_out = datetime.datetime.now() >= end_time
 
@@ -197,38 +269,41 @@ class Crawler:
 
     async def crawl(self) -> None:
         """
-        Collects links from our root urls, stores them and then calls
-        `_browse_from_links` to browse them
+        Starts workers browsing from random root urls
+        until the timeout is reached, closes the session at the end
         """
         logging.info("Noising started")
         self._start_time = datetime.datetime.now()
 
-        while True:
-            # TODO: use workers here
-            url = random.choice(settings.ROOT_URLS)
-            try:
-                body = await request(url)
-                self._links = self._extract_urls(body, url)
-                logging.debug("%s: found %s links", url, len(self._links))
-                await self._browse_from_links()
-
-            except aiohttp.ClientError:
-                logging.warning("%s: error connecting to root url", url)
-
-            except MemoryError:
-                logging.warning("%s: content is exhausting the memory", url)
+        queue: asyncio.Queue[Task] = asyncio.Queue()
+        for _ in range(self._cfg.concurrency):
+            queue.put_nowait(self._root_task())
 
-            except CrawlerTimedOut:
-                logging.info("Timeout has exceeded, exiting")
-                return
-
-            except Exception as e:
-                logging.warning("%s: error occurred: %s", url, repr(e))
+        workers = [
+            asyncio.create_task(self._worker(queue))
+            for _ in range(self._cfg.concurrency)
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except CrawlerTimedOut:
+            logging.info("Timeout has exceeded, exiting")
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            await self.close()
 
         logging.info("Noising finished")
 
 
 async def main() -> None:
+    logging.basicConfig(
+        format=settings.LOG_FMT,
+        datefmt=settings.DATE_FMT,
+        style='{',
+        level=settings.get_settings().log_level
+    )
+
     crawler = Crawler()
     await crawler.crawl()
 
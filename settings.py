@@ -1,28 +1,58 @@
+import functools
 import json
-import os
+from dataclasses import dataclass
 
 from environs import Env
 
-env = Env()
-env.read_env()
-
 LOG_FMT = "{levelname:<7} [{asctime},{msecs:3.0f}] " \
           "[{funcName}():{lineno}] {message}"
 DATE_FMT = "%Y-%m-%d %H:%M:%S"
 
-REQUEST_TIMEOUT = env.int("REQUEST_TIMEOUT", 5)
-MAX_DEPTH = env.int("MAX_DEPTH", 25)
-MIN_SLEEP = env.int("MIN_SLEEP", 3)
-MAX_SLEEP = env.int("MAX_SLEEP", 6)
-TIMEOUT = env.int("TIMEOUT", 0)
-LOG_LEVEL = env.log_level("LOG_LEVEL", 'debug')
-URLS_PATH = env.path("URLS_PATH", "./urls.json")
 
-with URLS_PATH.open() as f:
-    urls = json.load(f)
+@dataclass(frozen=True, slots=True)
+class Config:
+    request_timeout: int
+    max_body_size: int
+    max_depth: int
+    min_sleep: int
+    max_sleep: int
+    timeout: int
+    concurrency: int
+    connections_limit: int
+    connections_per_host_limit: int
+    dns_cache_ttl: int
+    log_level: int
+    root_urls: tuple[str, ...]
+    blacklisted_urls: tuple[str, ...]
+    user_agents: tuple[str, ...]
+
+
+@functools.lru_cache(maxsize=1)
+def get_settings() -> Config:
+    """
+    Reads the environment and the urls file on the first call,
+    the next calls return the same settings
+    :return: settings
+    """
+    env = Env()
+    env.read_env()
 
-ROOT_URLS = urls.get("ROOT_URLS", [])
-BLACKLISTED_URLS = urls.get("blacklisted_urls", [])
-USER_AGENTS = urls.get("USER_AGENTS", [])
+    with env.path("URLS_PATH", "./urls.json").open() as f:
+        urls = json.load(f)
 
-os.environ.clear()
+    return Config(
+        request_timeout=env.int("REQUEST_TIMEOUT", 5),
+        max_body_size=env.int("MAX_BODY_SIZE", 2 * 1024 * 1024),
+        max_depth=env.int("MAX_DEPTH", 25),
+        min_sleep=env.int("MIN_SLEEP", 3),
+        max_sleep=env.int("MAX_SLEEP", 6),
+        timeout=env.int("TIMEOUT", 0),
+        concurrency=env.int("CONCURRENCY", 4),
+        connections_limit=env.int("CONNECTIONS_LIMIT", 100),
+        connections_per_host_limit=env.int("CONNECTIONS_PER_HOST_LIMIT", 4),
+        dns_cache_ttl=env.int("DNS_CACHE_TTL", 300),
+        log_level=env.log_level("LOG_LEVEL", 'debug'),
+        root_urls=tuple(urls.get("ROOT_URLS", [])),
+        blacklisted_urls=tuple(urls.get("BLACKLISTED_URLS", [])),
+        user_agents=tuple(urls.get("USER_AGENTS", [])),
+    )